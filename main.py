@@ -1,171 +1,343 @@
-import os
-import re
-import time
-import unicodedata
-import requests
-import pandas as pd
-from rapidfuzz import process, fuzz
-from telegram import Update
-from telegram.ext import Application, MessageHandler, filters, ContextTypes
-
-TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
-SHEETS_CSV_URL = os.environ.get("SHEETS_CSV_URL", "")
-
-CATALOG_CACHE = {"df": None, "ts": 0}
-CACHE_TTL_SECONDS = 60
-
-
-def normalize_text(s: str) -> str:
-    s = (s or "").lower().strip()
-    s = unicodedata.normalize("NFD", s)
-    s = "".join(c for c in s if unicodedata.category(c) != "Mn")
-    s = re.sub(r"[^\w\s|]", " ", s)
-    s = re.sub(r"\s+", " ", s)
-    return s
-
-
-def load_catalog() -> pd.DataFrame:
-    now = time.time()
-    if CATALOG_CACHE["df"] is not None and (now - CATALOG_CACHE["ts"] < CACHE_TTL_SECONDS):
-        return CATALOG_CACHE["df"]
-
-    if not SHEETS_CSV_URL:
-        raise ValueError("SHEETS_CSV_URL não configurado.")
-
-    resp = requests.get(SHEETS_CSV_URL, timeout=20)
-    resp.raise_for_status()
-
-    from io import StringIO
-    df = pd.read_csv(StringIO(resp.text))
-
-    df.columns = [normalize_text(c).replace(" ", "_") for c in df.columns]
-
-    expected = ["nome_popular", "preco", "estoque", "vaso", "luz", "rega", "pets", "observacoes", "apelido"]
-    for col in expected:
-        if col not in df.columns:
-            df[col] = ""
-
-    df["__search"] = (
-        df["nome_popular"].astype(str).fillna("") + " | " + df["apelido"].astype(str).fillna("")
-    ).apply(normalize_text)
-
-    CATALOG_CACHE["df"] = df
-    CATALOG_CACHE["ts"] = now
-    return df
-
-
-def detect_intent(msg: str) -> str:
-    m = normalize_text(msg)
-
-    if any(k in m for k in ["quanto", "preco", "valor", "custa"]):
-        return "PRICE"
-    if any(k in m for k in ["tem", "estoque", "disponivel"]):
-        return "STOCK"
-    if any(k in m for k in ["rega", "luz", "sol", "sombra", "cuidar"]):
-        return "CARE"
-    if any(k in m for k in ["indica", "sugere", "recomenda"]):
-        return "SUGGEST"
-    return "GENERAL"
-
-
-def find_product(df: pd.DataFrame, query: str):
-    q = normalize_text(query)
-    if not q:
-        return None, []
-
-    tokens = q.split()
-
-    def match_tokens(name):
-        name = normalize_text(name)
-        return all(t.rstrip("s") in name for t in tokens)
-
-    filtered = df[df["nome_popular"].astype(str).apply(match_tokens)]
-
-    if len(filtered) == 1:
-        return filtered.iloc[0], [(filtered.iloc[0], 100)]
-
-    if len(filtered) > 1:
-        return None, [(row, 90) for _, row in filtered.iterrows()]
-
-    matches = process.extract(q, df["__search"].tolist(), scorer=fuzz.WRatio, limit=5)
-    top = [(df.iloc[idx], score) for (_, score, idx) in matches if score >= 75]
-
-    if len(top) == 1:
-        return top[0][0], top
-
-    if len(top) > 1:
-        return None, top
-
-    return None, []
-
-
-def format_product_answer(prod: pd.Series, intent: str) -> str:
-    nome = str(prod.get("nome_popular", "")).strip()
-    preco = str(prod.get("preco", "")).strip()
-
-    preco_formatado = ""
-
-    try:
-        # troca vírgula por ponto se vier assim
-        valor = float(preco.replace(",", "."))
-        preco_formatado = f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except:
-        preco_formatado = ""
-
-    if preco and preco.lower() != "nan":
-        return f"🌿 **{nome}**\n💰 **Preço:** {preco_formatado}"
-    else:
-        return f"🌿 **{nome}**\n💰 Preço não cadastrado"
-
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    msg = update.message.text if update.message else ""
-    if not msg:
-        return
-
-    intent = detect_intent(msg)
-
-    query = normalize_text(msg)
-    for w in ["preco", "valor", "quanto", "custa"]:
-        query = query.replace(w, "")
-    query = query.strip()
-    query = " ".join(w for w in query.split() if w not in ["da", "de", "do", "das", "dos"])
-
-    df = load_catalog()
-
-    prod, top = find_product(df, query)
-
-    if prod is None:
-        if len(top) >= 2:
-            options = [f"• {t[0].get('nome_popular','')}" for t in top[:3]]
-            await update.message.reply_text(
-                "Achei mais de uma parecida 👀 Qual delas você quis dizer?\n\n" + "\n".join(options)
-            )
-            return
-
-        await update.message.reply_text(
-            "Não achei esse item no catálogo 😕\n"
-            "Você pode tentar:\n"
-            "• outro nome\n"
-            "• escrever só a 1ª palavra\n"
-            "• ou me mandar o nome certinho"
-        )
-        return
-
-    answer = format_product_answer(prod, intent)
-    await update.message.reply_text(answer, parse_mode="Markdown")
-
-
-def main():
-    if not TELEGRAM_BOT_TOKEN:
-        raise ValueError("Defina TELEGRAM_BOT_TOKEN nas variáveis de ambiente.")
-
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    app.run_polling(close_loop=False)
-
-
-if __name__ == "__main__":
-    main()
-
-
-
+import asyncio
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from io import StringIO
+
+import aiohttp
+import numpy as np
+import pandas as pd
+from rapidfuzz import process, fuzz
+from telegram import Update
+from telegram.ext import Application, MessageHandler, filters, ContextTypes
+
+from text_utils import detect_intent, extract_query, normalize_text
+
+TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
+SHEETS_CSV_URL = os.environ.get("SHEETS_CSV_URL", "")
+# com PUBLIC_URL definido o bot sobe em modo webhook; sem ele, long-polling
+PUBLIC_URL = os.environ.get("PUBLIC_URL", "")
+PORT = int(os.environ.get("PORT", "8443"))
+
+CATALOG_CACHE = {
+    "df": None,
+    "cols": None,
+    "index": None,
+    "n": 0,
+    "ts": 0,
+    "etag": None,
+    "last_modified": None,
+}
+CACHE_TTL_SECONDS = 60
+
+EXPECTED_COLUMNS = ["nome_popular", "preco", "estoque", "vaso", "luz", "rega", "pets", "observacoes", "apelido"]
+
+DISK_CACHE_PATH = "/tmp/catalog.parquet"
+DISK_META_PATH = "/tmp/catalog.meta.json"
+
+_HTTP_SESSION = None
+# single-flight: N misses concorrentes de cache viram 1 download + N-1 awaits
+_REFRESH_TASK = None
+
+
+def _get_http_session() -> aiohttp.ClientSession:
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None or _HTTP_SESSION.closed:
+        # keep-alive para docs.google.com evita refazer TCP+TLS a cada refresh
+        _HTTP_SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=4, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=20),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+    return _HTTP_SESSION
+
+
+async def _fetch_csv(headers: dict):
+    session = _get_http_session()
+    last_err = None
+    for attempt in range(3):
+        try:
+            async with session.get(SHEETS_CSV_URL, headers=headers) as resp:
+                if resp.status == 304:
+                    return 304, None, None, None
+                resp.raise_for_status()
+                text = await resp.text()
+                return resp.status, text, resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            last_err = err
+            if attempt < 2:
+                await asyncio.sleep(0.2 * (2 ** attempt))
+    raise last_err
+
+
+def _clear_refresh_task(_task) -> None:
+    global _REFRESH_TASK
+    _REFRESH_TASK = None
+
+
+async def load_catalog_async() -> pd.DataFrame:
+    global _REFRESH_TASK
+
+    now = time.time()
+    if CATALOG_CACHE["df"] is not None and (now - CATALOG_CACHE["ts"] < CACHE_TTL_SECONDS):
+        return CATALOG_CACHE["df"]
+
+    if not SHEETS_CSV_URL:
+        raise ValueError("SHEETS_CSV_URL não configurado.")
+
+    task = _REFRESH_TASK
+    if task is None:
+        task = asyncio.create_task(_refresh_catalog())
+        task.add_done_callback(_clear_refresh_task)
+        _REFRESH_TASK = task
+    # shield: um handler cancelado não derruba o refresh dos outros
+    return await asyncio.shield(task)
+
+
+async def _refresh_catalog() -> pd.DataFrame:
+    # processo recém-reiniciado: tenta o cache em disco antes de baixar
+    if CATALOG_CACHE["df"] is None:
+        df, etag, last_modified = await asyncio.to_thread(_load_catalog_from_disk)
+        if df is not None:
+            CATALOG_CACHE["df"] = df
+            _index_catalog(df)
+            CATALOG_CACHE["etag"] = etag
+            CATALOG_CACHE["last_modified"] = last_modified
+
+    headers = {}
+    if CATALOG_CACHE["df"] is not None:
+        if CATALOG_CACHE["etag"]:
+            headers["If-None-Match"] = CATALOG_CACHE["etag"]
+        if CATALOG_CACHE["last_modified"]:
+            headers["If-Modified-Since"] = CATALOG_CACHE["last_modified"]
+
+    status, text, etag, last_modified = await _fetch_csv(headers)
+    if status == 304:
+        CATALOG_CACHE["ts"] = time.time()
+        return CATALOG_CACHE["df"]
+
+    df = await asyncio.to_thread(_parse_catalog, text)
+
+    CATALOG_CACHE["df"] = df
+    _index_catalog(df)
+    CATALOG_CACHE["ts"] = time.time()
+    CATALOG_CACHE["etag"] = etag
+    CATALOG_CACHE["last_modified"] = last_modified
+    await asyncio.to_thread(_save_catalog_to_disk, df, etag, last_modified)
+    return df
+
+
+def _index_catalog(df: pd.DataFrame) -> dict:
+    # colunas como listas simples: indexar por posição evita construir uma
+    # pd.Series por linha a cada resposta
+    cols = {
+        c: df[c].astype(str).where(df[c].notna(), "").tolist()
+        for c in EXPECTED_COLUMNS + ["__search"]
+    }
+    CATALOG_CACHE["cols"] = cols
+    CATALOG_CACHE["n"] = len(df)
+
+    # índice invertido radical/prefixo -> linhas, para o filtro multi-token
+    index = defaultdict(set)
+    for i, s in enumerate(cols["__search"]):
+        for token in s.split():
+            if token == "|":
+                continue
+            stem = token.rstrip("s")
+            index[stem].add(i)
+            for k in range(3, len(stem)):
+                index[stem[:k]].add(i)
+    CATALOG_CACHE["index"] = index
+    return cols
+
+
+def _product_at(cols: dict, i: int) -> dict:
+    return {c: cols[c][i] for c in EXPECTED_COLUMNS}
+
+
+def _load_catalog_from_disk():
+    try:
+        df = pd.read_parquet(DISK_CACHE_PATH)
+        with open(DISK_META_PATH) as f:
+            meta = json.load(f)
+    except Exception:
+        return None, None, None
+    return df, meta.get("etag"), meta.get("last_modified")
+
+
+def _save_catalog_to_disk(df: pd.DataFrame, etag, last_modified):
+    try:
+        df.to_parquet(DISK_CACHE_PATH)
+        with open(DISK_META_PATH, "w") as f:
+            json.dump({"etag": etag, "last_modified": last_modified}, f)
+    except Exception:
+        pass
+
+
+def _parse_catalog(text: str) -> pd.DataFrame:
+    # strings ficam em arrays Arrow em vez de objetos Python, bem mais enxuto
+    df = pd.read_csv(StringIO(text), engine="pyarrow", dtype_backend="pyarrow")
+
+    df.columns = [normalize_text(c).replace(" ", "_") for c in df.columns]
+
+    # não materializa colunas extras que alguém criou na planilha
+    df = df[[c for c in df.columns if c in EXPECTED_COLUMNS]]
+
+    # célula vazia vira "" já aqui: com dtype Arrow, NA viraria o literal
+    # "<NA>" no astype(str), vazando para __search e para as respostas
+    for col in EXPECTED_COLUMNS:
+        if col not in df.columns:
+            df[col] = ""
+        else:
+            df[col] = df[col].astype("string[pyarrow]").fillna("")
+
+    # colunas de baixa cardinalidade viram category
+    for col in ("luz", "pets", "vaso"):
+        df[col] = df[col].astype(str).astype("category")
+
+    df["__search"] = (
+        df["nome_popular"].astype(str) + " | " + df["apelido"].astype(str)
+    ).apply(normalize_text)
+
+    return df
+
+
+def find_product(df: pd.DataFrame, query: str):
+    q = normalize_text(query)
+    if not q:
+        return None, []
+
+    tokens = q.split()
+    if not tokens:
+        return None, []
+
+    cols = CATALOG_CACHE["cols"] or _index_catalog(df)
+    index = CATALOG_CACHE["index"]
+
+    hits = None
+    for t in tokens:
+        rows = index.get(t.rstrip("s"))
+        if not rows:
+            hits = set()
+            break
+        hits = rows if hits is None else hits & rows
+        if not hits:
+            break
+
+    filtered_idx = sorted(hits)
+
+    if len(filtered_idx) == 1:
+        prod = _product_at(cols, int(filtered_idx[0]))
+        return prod, [(prod, 100)]
+
+    if len(filtered_idx) > 1:
+        return None, [(_product_at(cols, int(i)), 90) for i in filtered_idx]
+
+    choices = cols["__search"]
+    scores = process.cdist(
+        [q],
+        choices,
+        scorer=fuzz.partial_token_set_ratio,
+        processor=None,
+        score_cutoff=75,
+        workers=-1,
+        dtype=np.uint8,
+    )[0]
+    if not scores.any():
+        return None, []
+
+    # top-5 em tempo linear: abaixo do cutoff o cdist devolve 0
+    if scores.size <= 5:
+        best_idx = np.argsort(scores)[::-1]
+    else:
+        best_idx = np.argpartition(scores, -5)[-5:]
+        best_idx = best_idx[np.argsort(scores[best_idx])[::-1]]
+
+    top = [(_product_at(cols, int(i)), int(scores[i])) for i in best_idx if scores[i] >= 75]
+
+    if len(top) == 1:
+        return top[0][0], top
+
+    return None, top
+
+
+# preço vindo da planilha: só dígitos com separador decimal opcional (, ou .)
+_PRICE_RE = re.compile(r"^\s*\d+(?:[.,]\d+)?\s*$")
+# troca separadores en-US -> pt-BR em uma passada
+_PRICE_TRANS = str.maketrans({",": ".", ".": ","})
+
+
+def format_product_answer(prod: dict, intent: str) -> str:
+    nome = str(prod.get("nome_popular", "")).strip()
+    preco = str(prod.get("preco", "")).strip()
+
+    preco_formatado = ""
+    if _PRICE_RE.match(preco):
+        valor = float(preco.replace(",", "."))
+        preco_formatado = f"R$ {valor:,.2f}".translate(_PRICE_TRANS)
+
+    if preco and preco.lower() != "nan":
+        return f"🌿 **{nome}**\n💰 **Preço:** {preco_formatado}"
+    else:
+        return f"🌿 **{nome}**\n💰 Preço não cadastrado"
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message.text if update.message else ""
+    if not msg:
+        return
+
+    intent = detect_intent(msg)
+    query = extract_query(msg)
+
+    df = await load_catalog_async()
+
+    prod, top = find_product(df, query)
+
+    if prod is None:
+        if len(top) >= 2:
+            options = [f"• {t[0].get('nome_popular','')}" for t in top[:3]]
+            await update.message.reply_text(
+                "Achei mais de uma parecida 👀 Qual delas você quis dizer?\n\n" + "\n".join(options)
+            )
+            return
+
+        await update.message.reply_text(
+            "Não achei esse item no catálogo 😕\n"
+            "Você pode tentar:\n"
+            "• outro nome\n"
+            "• escrever só a 1ª palavra\n"
+            "• ou me mandar o nome certinho"
+        )
+        return
+
+    answer = format_product_answer(prod, intent)
+    await update.message.reply_text(answer, parse_mode="Markdown")
+
+
+def main():
+    if not TELEGRAM_BOT_TOKEN:
+        raise ValueError("Defina TELEGRAM_BOT_TOKEN nas variáveis de ambiente.")
+
+    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+
+    if PUBLIC_URL:
+        # Telegram entrega cada update via POST, sem o round-trip do getUpdates
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=TELEGRAM_BOT_TOKEN,
+            webhook_url=f"{PUBLIC_URL.rstrip('/')}/{TELEGRAM_BOT_TOKEN}",
+            close_loop=False,
+        )
+    else:
+        app.run_polling(close_loop=False)
+
+
+if __name__ == "__main__":
+    main()
+
+
+
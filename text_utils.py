@@ -0,0 +1,64 @@
+"""Funções de texto do caminho quente (uma chamada por mensagem).
+
+Isoladas em um módulo próprio, com anotações completas, para poderem ser
+compiladas (ex.: ``mypyc text_utils.py`` ou Cython) sem mexer no resto do
+bot — a API pública continua a mesma para o ``main``.
+"""
+
+import functools
+import re
+import unicodedata
+
+_NON_WORD_RE = re.compile(r"[^\w\s|]")
+_WS_RE = re.compile(r"\s+")
+
+# diacríticos latinos usados em português (aplicado depois do lower())
+_ACCENT_MAP = str.maketrans(
+    "áàâãäéèêëíìîïóòôõöúùûüçñ",
+    "aaaaaeeeeiiiiooooouuuucn",
+)
+
+# mensagens já passam por normalize_text, então os padrões ficam sem acento
+_INTENT_PATTERNS: list[tuple[str, re.Pattern]] = [
+    ("PRICE", re.compile(r"\b(quanto|preco|valor|custa)\b")),
+    ("STOCK", re.compile(r"\b(tem|estoque|disponivel)\b")),
+    ("CARE", re.compile(r"\b(rega|luz|sol|sombra|cuidar)\b")),
+    ("SUGGEST", re.compile(r"\b(indica|sugere|recomenda)\b")),
+]
+
+
+@functools.lru_cache(maxsize=8192)
+def _normalize_text_cached(s: str) -> str:
+    s = s.lower().strip()
+    s = s.translate(_ACCENT_MAP)
+    if not s.isascii():
+        # algo fora do mapa latino: caminho completo via decomposição NFD
+        s = unicodedata.normalize("NFD", s)
+        s = "".join(c for c in s if unicodedata.category(c) != "Mn")
+    s = _NON_WORD_RE.sub(" ", s)
+    s = _WS_RE.sub(" ", s)
+    return s
+
+
+def normalize_text(s: str) -> str:
+    if not s:
+        return ""
+    return _normalize_text_cached(s)
+
+
+def detect_intent(msg: str) -> str:
+    m = normalize_text(msg)
+
+    for intent, pattern in _INTENT_PATTERNS:
+        if pattern.search(m):
+            return intent
+    return "GENERAL"
+
+
+# palavras de intenção + stopwords removidas da consulta em uma passada só
+_QUERY_STRIP_RE = re.compile(r"\b(preco|valor|quanto|custa|da|de|do|das|dos)\b")
+
+
+def extract_query(msg: str) -> str:
+    query = _QUERY_STRIP_RE.sub("", normalize_text(msg))
+    return _WS_RE.sub(" ", query).strip()